@@ -38,7 +38,7 @@ apt-get --quiet --yes --allow-unauthenticated install \
         libcurl4-gnutls-dev libdb-dev liblept5 libleptonica-dev liblz4-tool libmagic-dev libmysqlclient-dev \
         libpcre3-dev libpq-dev libsqlite3-dev libssl-dev libstemmer-dev libtesseract-dev libwebp7 libxerces-c-dev \
         libxml2-dev libxml2-utils locales-all make mawk mutt nlohmann-json3-dev openjdk-17-jdk p7zip-full poppler-utils postgresql-client \
-        python3 python3-paramiko \
+        python3 python3-paramiko python3-requests \
         tesseract-ocr tesseract-ocr-all rsync sqlite3 tcl-expect-dev tidy unzip \
         uuid-dev xsltproc libsystemd-dev
 
@@ -0,0 +1,6 @@
+#!/bin/bash
+set -o errexit
+
+# install requests library (and urllib3) as a dependency of initiate_marc_pipeline.py
+
+apt-get --yes install python3-requests
@@ -2,39 +2,67 @@
 # -*- coding: utf-8 -*-
 
 from sftp_connection import SFTPConnection
+import concurrent.futures
 import os
 import re
 import time
 import util
 
 
-def FoundNewBSZDataFile(link_filename):
+# Matches the first 6 digit sequence in a filename hoping it corresponds to a YYMMDD pattern.
+DATE_EXTRACTION_REGEX = re.compile(".+(\\d{6}).+")
+WITHOUT_LOCALDATA_REGEX = re.compile("_o[)]?-[(]?.*[)]?")
+
+# Maps filename patterns from the config file to their compiled regexes.
+compiled_filename_regexes = {}
+
+# Maps credential types to (host, username, password) tuples, cf. GetFTPCredentials().
+ftp_credentials = {}
+
+
+# Returns True if we have no timestamp file or if link_filename's creation time is more recent than
+# the time found in the timestamp file.
+# @param timestamp_prefix  Passed on to util.ReadTimestamp(), allows checking against another script's timestamp.
+def FoundNewBSZDataFile(link_filename, timestamp_prefix=None):
     try:
         statinfo = os.stat(link_filename)
         file_creation_time = statinfo.st_ctime
     except OSError:
         util.Error("Symlink \"" + link_filename + "\" is missing or dangling!")
-    old_timestamp = util.ReadTimestamp()
+    old_timestamp = util.ReadTimestamp(timestamp_prefix)
     return old_timestamp < file_creation_time
 
 
-def GetFTPConnection(credential_type=None):
-    ftp_host   = ""
-    ftp_user   = ""
-    ftp_passwd = ""
+# Extracts the title and norm data from the BSZ dump "link_name" points to, reusing the files if another cronjob
+# already extracted the same dump, cf. util.ExtractAndRenameBSZFilesOnce().
+# @return The list of names of the extracted files in the order: title data, norm data
+def ExtractBSZDataFromLink(link_name):
+    bsz_data = util.ResolveSymlink(link_name)
+    if not bsz_data.endswith(".tar.gz"):
+        util.Error("BSZ data file must end in .tar.gz!")
+    return util.ExtractAndRenameBSZFilesOnce(bsz_data)
+
+
+# Returns the (host, username, password) for "credential_type" from BSZ.conf.  The results are cached as every
+# parallel download opens a connection of its own and would otherwise reload the config file.
+def GetFTPCredentials(credential_type):
+    if credential_type in ftp_credentials:
+        return ftp_credentials[credential_type]
     try:
         bsz_config = util.LoadConfigFile(util.default_config_file_dir + "BSZ.conf")
-        if credential_type != None :
-            ftp_host   = bsz_config.get(credential_type, "host")
-            ftp_user   = bsz_config.get(credential_type, "username")
-            ftp_passwd = bsz_config.get(credential_type, "password")
-        else:
-            ftp_host   = bsz_config.get("SFTP_Download", "host")
-            ftp_user   = bsz_config.get("SFTP_Download", "username")
-            ftp_passwd = bsz_config.get("SFTP_Download", "password")
+        ftp_host   = bsz_config.get(credential_type, "host")
+        ftp_user   = bsz_config.get(credential_type, "username")
+        ftp_passwd = bsz_config.get(credential_type, "password")
     except Exception as e:
         util.Error("failed to read config file! (" + str(e) + ")")
+    ftp_credentials[credential_type] = (ftp_host, ftp_user, ftp_passwd)
+    return ftp_credentials[credential_type]
+
 
+def GetFTPConnection(credential_type=None):
+    if credential_type is None:
+        credential_type = "SFTP_Download"
+    ftp_host, ftp_user, ftp_passwd = GetFTPCredentials(credential_type)
     return SFTPConnection(ftp_host, ftp_user, ftp_passwd)
 
 
@@ -97,9 +125,7 @@ def GetBackupDirectoryPath(config):
 
 # Check whether all the instances are needed
 def NeedsBothInstances(filename_regex):
-    without_localdata_pattern = "_o[)]?-[(]?.*[)]?"
-    without_localdata_regex = re.compile(without_localdata_pattern)
-    return without_localdata_regex.search(filename_regex.pattern) is not None
+    return WITHOUT_LOCALDATA_REGEX.search(filename_regex.pattern) is not None
 
 
 # For IxTheo our setup requires that we obtain both the files with and without local data because otherwise
@@ -111,22 +137,78 @@ def AreBothInstancesPresent(filename_regex, remote_files):
     return len(matching_remote_files) % 2 == 0
 
 
+# The maximum number of simultaneous connections used for downloading, cf. the "parallel" entry in the
+# "FTP" section of the config file.
+def GetMaxParallelDownloads(config):
+    try:
+        max_parallel_downloads = config.getint("FTP", "parallel", fallback=4)
+    except Exception as e:
+        util.Error("Invalid \"parallel\" entry in the \"FTP\" section of the config file! (" + str(e) + ")")
+    if max_parallel_downloads < 1:
+        util.Error("\"parallel\" in the \"FTP\" section of the config file must be at least 1!")
+    return max_parallel_downloads
+
+
+# Downloads "filename" from "remote_directory" over a connection of its own, as the connections themselves
+# cannot be shared between threads.
+def DownloadRemoteFileWithOwnConnection(filename, remote_directory):
+    ftp = GetFTPConnection()
+    try:
+        ftp.changeDirectory(remote_directory)
+        ftp.downloadFile(filename, filename)
+    finally:
+        ftp.disconnect()
+
+
+# Downloads files over up to "max_parallel_downloads" connections of their own in the background, so that the caller
+# can carry on, e.g. listing further remote directories, while downloads are still in flight.
+class BackgroundDownloader:
+    _executor = None
+    _downloads = None
+
+    def __init__(self, max_parallel_downloads):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel_downloads)
+        self._downloads = []
+
+    def downloadFile(self, filename, remote_directory):
+        self._downloads.append(self._executor.submit(DownloadRemoteFileWithOwnConnection, filename, remote_directory))
+
+    # Blocks until all downloads have finished.  Re-raises the first exception, including SystemExit from
+    # util.Error, of a failed download.
+    def waitForDownloads(self):
+        try:
+            for download in self._downloads:
+                download.result()
+        finally:
+            self._downloads = []
+            self._executor.shutdown()
+
+
 # Downloads matching files found in "remote_directory" on the FTP server that have a datestamp
-# more recent than "download_cutoff_date" if some consistency check succeeds
-def DownloadRemoteFiles(config, ftp, filename_regex, remote_directory, download_cutoff_date):
+# more recent than "download_cutoff_date" if some consistency check succeeds.
+# The files are fetched over up to GetMaxParallelDownloads() simultaneous connections since a single
+# connection usually does not saturate the available bandwidth.
+# If "downloader" is not None, the downloads are only queued with it and the caller has to call its
+# waitForDownloads() before using the files.
+def DownloadRemoteFiles(config, ftp, filename_regex, remote_directory, download_cutoff_date, downloader=None):
     filenames = GetListOfRemoteFiles(ftp, filename_regex, remote_directory, download_cutoff_date)
     if NeedsBothInstances(filename_regex):
         if not AreBothInstancesPresent(filename_regex, filenames):
             util.Error("Skip downloading since apparently generation of the files on the FTP server is not complete!")
-    for filename in filenames:
-        ftp.downloadFile(filename, filename)
+    if downloader is None:
+        own_downloader = BackgroundDownloader(GetMaxParallelDownloads(config))
+        for filename in filenames:
+            own_downloader.downloadFile(filename, remote_directory)
+        own_downloader.waitForDownloads()
+    else:
+        for filename in filenames:
+            downloader.downloadFile(filename, remote_directory)
     return filenames
 
 
 # Extracts the first 6 digit sequence in "filename" hoping it corresponds to a YYMMDD pattern.
 def ExtractDateFromFilename(filename):
-    date_extraction_regex = re.compile(".+(\\d{6}).+")
-    match = date_extraction_regex.match(filename)
+    match = DATE_EXTRACTION_REGEX.match(filename)
     if not match:
         util.Error("\"" + filename + "\" does not contain a date!")
     return match.group(1)
@@ -134,7 +216,7 @@ def ExtractDateFromFilename(filename):
 
 def GetCutoffDateForDownloads(config):
     backup_directory = GetBackupDirectoryPath(config)
-    most_recent_backup_file = GetMostRecentLocalFile(re.compile(".+(\\d{6}).+"), backup_directory)
+    most_recent_backup_file = GetMostRecentLocalFile(DATE_EXTRACTION_REGEX, backup_directory)
     if most_recent_backup_file is None:
         return "000000"
     else:
@@ -146,14 +228,42 @@ def GetFilenameRegexForSection(config, section):
         filename_pattern = config.get(section, "filename_pattern")
     except Exception as e:
         util.Error("Invalid section " + section + "in config file! (" + str(e) + ")")
+    if filename_pattern in compiled_filename_regexes:
+        return compiled_filename_regexes[filename_pattern]
     try:
         filename_regex = re.compile(filename_pattern)
     except Exception as e:
         util.Error("filename pattern \"" + filename_pattern + "\" failed to compile! ("
                    + str(e) + ")")
+    compiled_filename_regexes[filename_pattern] = filename_regex
     return filename_regex
 
 
+# Combines the filename patterns of "sections" into a single alternation with one named group per section, so that
+# a filename can be assigned to its section with a single match instead of one match per section.
+# N.B. The patterns must not overlap as a filename is only assigned to the first matching section.
+# @return A map from each of "sections" to the list of the "filenames" matching the section's filename pattern.
+def ClassifyFilenamesBySection(config, sections, filenames):
+    group_names_to_sections = {}
+    alternatives = []
+    for section_no, section in enumerate(sections):
+        group_name = "section" + str(section_no)
+        group_names_to_sections[group_name] = section
+        alternatives.append("(?P<" + group_name + ">" + GetFilenameRegexForSection(config, section).pattern + ")")
+    try:
+        combined_regex = re.compile("|".join(alternatives))
+    except Exception as e:
+        util.Error("combined filename pattern for " + str(sections) + " failed to compile! (" + str(e) + ")")
+
+    filenames_by_section = { section: [] for section in sections }
+    for filename in filenames:
+        match = combined_regex.match(filename)
+        if match:
+            # The enclosing named group is the last one to close, so it is what lastgroup reports:
+            filenames_by_section[group_names_to_sections[match.lastgroup]].append(filename)
+    return filenames_by_section
+
+
 def GetFTPDirectoryForSection(config, section):
     try:
         directory_on_ftp_server = config.get(section, "directory_on_ftp_server")
@@ -1,10 +1,18 @@
 #!/bin/python3
 # -*- coding: utf-8 -*-
 import atexit
+import bsz_util
 import datetime
+import errno
+import fnmatch
 import multiprocessing
 import os
+import shutil
 import sys
+import subprocess
+import tarfile
+import tempfile
+import time
 import traceback
 import process_util
 import re
@@ -25,34 +33,76 @@ def ExecOrCleanShutdownAndDie(cmd_name, args, log_file_name=None):
         sys.exit(-1)
 
 
-def FoundNewBSZDataFile(link_filename):
+# Opens "fifo_path" for writing once "reader_process" has opened it for reading.  A plain blocking open would hang
+# forever if the reader exited before ever opening the FIFO, so we poll with O_NONBLOCK instead.
+# Returns None if "reader_process" has exited in the meantime.
+def OpenFIFOForWriting(fifo_path, reader_process):
+    while True:
+        try:
+            fifo_fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO: # ENXIO means that there is no reader yet.
+                raise
+        if reader_process.poll() is not None:
+            return None
+        time.sleep(0.1)
+    os.set_blocking(fifo_fd, True)
+    return os.fdopen(fifo_fd, "wb")
+
+
+# Streams the MARC records of "gzipped_tar_archive" through a FIFO into extract_referenceterms so that neither an
+# intermediate MARC file has to be written nor decompression and parsing have to wait for each other.
+# The archive is read in a single in-order pass ("r|gz") as gzip offers no random access.
+# N.B. The FIFO's name has to end in ".mrc" as the MARC reader cannot guess the file type of a FIFO from its contents.
+def ExtractReferenceTerms(gzipped_tar_archive, ref_data_marc_file, ref_data_synonym_file, log_file_name):
+    fifo_directory = tempfile.mkdtemp()
+    ref_data_marc_fifo = fifo_directory + "/" + ref_data_marc_file
+    extraction_failed = False
     try:
-        statinfo = os.stat(link_filename)
-        file_creation_time = statinfo.st_ctime
-    except OSError:
-        util.Error("in FoundNewBSZDataFile: Symlink \"" + link_filename + "\" is missing or dangling!")
-    old_timestamp = util.ReadTimestamp("initiate_marc_pipeline")
-    return old_timestamp < file_creation_time
-
-
-def ExtractRefDataMarcFile(gzipped_tar_archive, output_marc_file, log_file_name):
-    util.ExecOrDie("/usr/local/bin/extract_refterm_archive.sh", [gzipped_tar_archive, output_marc_file],
-                   log_file_name)
+        os.mkfifo(ref_data_marc_fifo)
+        with open(log_file_name, "ab") as log_file:
+            extract_referenceterms = subprocess.Popen(["/usr/local/bin/extract_referenceterms", ref_data_marc_fifo,
+                                                       ref_data_synonym_file], stdout=log_file, stderr=log_file)
+            try:
+                fifo = OpenFIFOForWriting(ref_data_marc_fifo, extract_referenceterms)
+                if fifo is None:
+                    raise OSError("extract_referenceterms exited before opening \"" + ref_data_marc_fifo + "\"")
+                with fifo:
+                    # Extract only authority records and concatenate them:
+                    matched_member_count = 0
+                    with tarfile.open(gzipped_tar_archive, "r|gz") as tar_file:
+                        for member in tar_file:
+                            if member.isfile() and fnmatch.fnmatchcase(member.name, "*c???.raw"):
+                                shutil.copyfileobj(tar_file.extractfile(member), fifo, 1 << 20)
+                                matched_member_count += 1
+                if matched_member_count == 0:
+                    log_file.write(("No \"*c???.raw\" members found in \"" + gzipped_tar_archive + "\"!\n").encode("utf-8"))
+                    extraction_failed = True
+            except (OSError, tarfile.TarError) as e:
+                log_file.write(("Failed to extract \"" + gzipped_tar_archive + "\"! (" + str(e) + ")\n").encode("utf-8"))
+                extraction_failed = True
+            extract_referenceterms_exit_code = extract_referenceterms.wait()
+    finally:
+        util.Remove(ref_data_marc_fifo)
+        os.rmdir(fifo_directory)
+
+    if extraction_failed or extract_referenceterms_exit_code != 0:
+        CleanUp(None, log_file_name)
+        util.SendEmail("ExtractReferenceTerms", "Failed to extract the reference terms from \"" + gzipped_tar_archive
+                       + "\".\nSee logfile \"" + log_file_name + "\" for the reason.", priority=1)
+        sys.exit(-1)
 
 
 def ExtractTitleDataMarcFile(link_name):
-    bsz_data = util.ResolveSymlink(link_name)
-
-    if not bsz_data.endswith(".tar.gz"):
-        util.Error("BSZ data file must end in .tar.gz!")
-    file_name_list = util.ExtractAndRenameBSZFiles(bsz_data)
+    file_name_list = bsz_util.ExtractBSZDataFromLink(link_name)
     title_data_file_name = [ file_name for file_name in file_name_list if file_name.startswith('GesamtTiteldaten') ]
     return title_data_file_name[0]
 
 
 def GetDateFromFilename(filename):
     try:
-        date_string = re.search('\d{6}', filename).group()
+        date_string = re.search(r'\d{6}', filename).group()
     except AttributeError:
         date_string = ''
     return date_string
@@ -60,8 +110,10 @@ def GetDateFromFilename(filename):
 
 def RenameTitleDataFile(title_data_file_orig, date_string):
     # Make sure we will not interfere with filenames used by the ordinary pipeline
+    # N.B. We link instead of renaming so that initiate_marc_pipeline.py can reuse the extracted original.
     title_data_file = "GesamtTiteldaten-" + date_string + "-temporary.mrc"
-    os.rename(title_data_file_orig, title_data_file);
+    util.Remove(title_data_file)
+    os.link(title_data_file_orig, title_data_file)
     return title_data_file
 
 
@@ -78,12 +130,9 @@ def CreateRefTermFile(ref_data_archive, date_string, conf, log_file_name):
     # Assemble Filenames
     ref_data_base_filename = "Hinweissätze-" + date_string
     ref_data_marc_file = ref_data_base_filename + ".mrc"
-    # Convert tar.gz to mrc
-    ExtractRefDataMarcFile(ref_data_archive, ref_data_marc_file, log_file_name)
     ref_data_synonym_file = ref_data_base_filename + ".txt"
-    # Make a refterm -> circumscription table file
-    ExecOrCleanShutdownAndDie("/usr/local/bin/extract_referenceterms", [ref_data_marc_file, ref_data_synonym_file],
-                   log_file_name)
+    # Make a refterm -> circumscription table file directly from the tar.gz
+    ExtractReferenceTerms(ref_data_archive, ref_data_marc_file, ref_data_synonym_file, log_file_name)
     # Create a file with a list of refterms and containing ids
     ExecOrCleanShutdownAndDie("/usr/local/bin/create_reference_import_file.sh", [ref_data_synonym_file, os.getcwd()],
                    log_file_name)
@@ -121,16 +170,6 @@ def CleanUp(title_data_file, log_file_name):
         util.Remove(title_data_file)
 
 
-def ExecuteInParallel(*processes):
-    for process in processes:
-        process.start()
-
-    for process in processes:
-        process.join()
-        if process.exitcode != 0:
-            util.Error(process.name + " failed")
-
-
 def CleanStaleMutex():
     if os.path.exists(REFTERM_MUTEX_FILE):
        os.remove(REFTERM_MUTEX_FILE)
@@ -156,7 +195,7 @@ def Main():
     else:
         ref_data_archive = None
 
-    if FoundNewBSZDataFile(title_data_link_name):
+    if bsz_util.FoundNewBSZDataFile(title_data_link_name, "initiate_marc_pipeline"):
         start = datetime.datetime.now()
         log_file_name = CreateLogFile()
         title_data_file_orig = ExtractTitleDataMarcFile(title_data_link_name)
@@ -169,7 +208,7 @@ def Main():
         create_match_db_log_file_name = util.MakeLogFileName("create_match_db", util.GetLogDirectory())
         create_match_db_process = multiprocessing.Process(target=CreateMatchDB, name="Create Match DB",
                                       args=[ title_data_file, create_match_db_log_file_name ])
-        ExecuteInParallel(setup_temporary_solr_instance_process, create_match_db_process)
+        util.ExecuteInParallel(setup_temporary_solr_instance_process, create_match_db_process)
         create_ref_term_process = multiprocessing.Process(target=CreateRefTermFile, name="Create Reference Terms File",
                                       args=[ ref_data_archive, date_string, conf, log_file_name ])
         create_serial_sort_term_process = multiprocessing.Process(target=CreateSerialSortDate, name="Serial Sort Date",
@@ -177,7 +216,7 @@ def Main():
         extract_fulltext_ids_log_file_name = util.MakeLogFileName("extract_fulltext_ids", util.GetLogDirectory())
         extract_fulltext_ids_process = multiprocessing.Process(target=CreateFulltextIdsFile, name="Create Fulltext IDs File",
                                            args=[ "/usr/local/ub_tools/bsz_daten/fulltext_ids.txt", extract_fulltext_ids_log_file_name ])
-        ExecuteInParallel(create_ref_term_process, create_serial_sort_term_process, extract_fulltext_ids_process)
+        util.ExecuteInParallel(create_ref_term_process, create_serial_sort_term_process, extract_fulltext_ids_process)
         end  = datetime.datetime.now()
         duration_in_minutes = str((end - start).seconds / 60.0)
         util.Touch(REFTERM_MUTEX_FILE)
@@ -4,7 +4,7 @@
 # A tool for the automation of tarball downloads from the BSZ.
 # Config files for this tool look like this:
 # (in addition, see BSZ.conf and smtp_server.conf)
-"""
+r"""
 [Kompletter Abzug]
 filename_pattern = ^SA-MARC-ixtheo-(\d\d\d\d\d\d).tar.gz$
 directory_on_ftp_server = /ixtheo
@@ -35,10 +35,15 @@ directory_on_ftp_server = /swb/ixtheo
 
 [Kumulierte Abzuege]
 output_directory = /usr/local/ub_tools/bsz_daten_cumulated
+
+[FTP]
+# optional, the maximum number of simultaneous download connections (defaults to 4)
+parallel = 4
 """
 
 import bsz_util
 import datetime
+import errno
 import os
 import re
 import shutil
@@ -51,6 +56,8 @@ import util
 DOWNLOAD_HAPPENED_MUTEX="/usr/local/var/tmp/bsz_download_happened"
 FETCH_UPDATES_RUN_MUTEX="/usr/local/var/tmp/fetch_updates_run"
 
+CUMULATIVE_FILENAME_DATE_REGEX = re.compile("\\D*?-(\\d{6}).*")
+
 
 # Returns "yymmdd_string" incremented by one day unless it equals "000000" (= minus infinity).
 def IncrementStringDate(yymmdd_string):
@@ -61,6 +68,20 @@ def IncrementStringDate(yymmdd_string):
     return date.strftime("%y%m%d")
 
 
+# Makes "source" available in "target_directory", replacing a file with the same name.  A hardlink costs a single
+# metadata operation, so we only copy if both are not on the same filesystem.
+def LinkOrCopyToDirectory(source, target_directory):
+    target = os.path.join(target_directory, os.path.basename(source))
+    if os.path.lexists(target):
+        os.unlink(target)
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy(source, target)
+
+
 # Cumulatively saves downloaded data to an external location to have a complete trace of
 # the downloaded data. Thus, the complete data should be reconstructible.
 def AddToCumulativeCollection(downloaded_files, config):
@@ -85,20 +106,27 @@ def AddToCumulativeCollection(downloaded_files, config):
     return None;
 
 
+# Returns a snapshot of the names of the regular files in "output_directory".  os.scandir() gets the file types along
+# with the names, so skipping anything else costs no additional stat calls.
 def CumulativeFilenameGenerator(output_directory):
-     return os.listdir(output_directory)
+     with os.scandir(output_directory) as entries:
+         return [ entry.name for entry in entries if entry.is_file(follow_symlinks=False) ]
 
 
 # We try to keep all differential updates up to and including the last complete data
 def CleanUpCumulativeCollection(config):
     backup_directory = bsz_util.GetBackupDirectoryPath(config)
     filename_complete_data_regex = bsz_util.GetFilenameRegexForSection(config, "Kompletter Abzug")
-    incremental_authority_data_regex = bsz_util.GetFilenameRegexForSection(config, "Normdatendifferenzabzug")
+
+    # Enumerate the backup directory only once and hand the result to all consumers
+    backup_filenames = CumulativeFilenameGenerator(backup_directory)
+    backup_filenames_by_section = bsz_util.ClassifyFilenamesBySection(config, [ "Kompletter Abzug", "Normdatendifferenzabzug" ],
+                                                                      backup_filenames)
 
     # Find the latest complete data file
     try:
         most_recent_complete_data_filename = bsz_util.GetMostRecentFile(filename_complete_data_regex,
-                                                               CumulativeFilenameGenerator(backup_directory))
+                                                                        backup_filenames_by_section["Kompletter Abzug"])
     except Exception as e:
         util.Error("Unable to to determine the most recent complete data file (" + str(e) + ")")
 
@@ -110,9 +138,10 @@ def CleanUpCumulativeCollection(config):
     if match and match.group(1):
         most_recent_complete_data_date = match.group(1)
         # Delete all older Files but skip incremental authority dumps
-        DeleteAllFilesOlderThan(most_recent_complete_data_date, backup_directory, incremental_authority_data_regex)
+        backup_filenames = DeleteAllFilesOlderThan(most_recent_complete_data_date, backup_directory, backup_filenames,
+                                                   set(backup_filenames_by_section["Normdatendifferenzabzug"]))
         # Now explicitly delete incremental authority dumps that are too old
-        DeleteAllFilesOlderThan(ShiftDateToTenDaysBefore(most_recent_complete_data_date), backup_directory)
+        DeleteAllFilesOlderThan(ShiftDateToTenDaysBefore(most_recent_complete_data_date), backup_directory, backup_filenames)
     return None
 
 
@@ -127,42 +156,42 @@ def CurrentIncrementalAuthorityDumpPresent(config, cutoff_date):
     return most_recent_file_incremental_authority_date > cutoff_date
 
 
-# Delete all files that are older than a given date
-def DeleteAllFilesOlderThan(date, directory, exclude_pattern=""):
-    filename_pattern = '\\D*?-(\\d{6}).*'
-    try:
-        filename_regex = re.compile(filename_pattern)
-    except Exception as e:
-        util.Error("File name pattern \"" + filename_pattern + "\" failed to compile! (" + str(e) + ")")
-
+# Delete all files in "filenames", the contents of "directory", that are older than a given date
+# unless they are in "excluded_filenames".
+# @return The filenames that have not been deleted.
+def DeleteAllFilesOlderThan(date, directory, filenames, excluded_filenames=frozenset()):
+    # Unlinking relative to an open directory descriptor spares the kernel resolving "directory" for each file
+    directory_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
     try:
-        exclude_regex = re.compile(exclude_pattern)
-    except Exception as e:
-        util.Error("Exclude pattern \"" + exclude_pattern + "\" failed to compile! (" + str(e) + ")")
-
-    for filename in CumulativeFilenameGenerator(directory):
-        match = filename_regex.match(filename)
-        if match and match.group(1) < date and not exclude_regex.match(filename):
-            os.remove(directory + "/" +  match.group())
+        remaining_filenames = []
+        for filename in filenames:
+            match = CUMULATIVE_FILENAME_DATE_REGEX.match(filename)
+            if match and match.group(1) < date and filename not in excluded_filenames:
+                os.unlink(match.group(0), dir_fd=directory_fd)
+            else:
+                remaining_filenames.append(filename)
+    finally:
+        os.close(directory_fd)
 
-    return None
+    return remaining_filenames
 
 
-def DownloadData(config, section, ftp, download_cutoff_date, msg):
+# N.B. The downloads are only queued with "downloader", cf. bsz_util.DownloadRemoteFiles().
+def DownloadData(config, section, ftp, download_cutoff_date, msg, downloader):
     filename_regex = bsz_util.GetFilenameRegexForSection(config, section)
     directory_on_ftp_server = bsz_util.GetFTPDirectoryForSection(config, section)
-    downloaded_files = bsz_util.DownloadRemoteFiles(config, ftp, filename_regex, directory_on_ftp_server, download_cutoff_date)
+    downloaded_files = bsz_util.DownloadRemoteFiles(config, ftp, filename_regex, directory_on_ftp_server, download_cutoff_date,
+                                                    downloader)
     if len(downloaded_files) == 0:
         msg.append("No more recent file for pattern \"" + filename_regex.pattern + "\"!\n")
     else:
-        msg.append("Successfully downloaded:\n" + '\n'.join(downloaded_files) + '\n')
+        msg.append("Queued for download:\n" + '\n'.join(downloaded_files) + '\n')
     return downloaded_files
 
 
-def DownloadCompleteData(config, ftp, download_cutoff_date, msg):
-    downloaded_files = DownloadData(config, "Kompletter Abzug", ftp, download_cutoff_date, msg)
-    complete_filename_pattern = config.get("Kompletter Abzug", "filename_pattern")
-    if not bsz_util.NeedsBothInstances(re.compile(complete_filename_pattern)):
+def DownloadCompleteData(config, ftp, download_cutoff_date, msg, downloader):
+    downloaded_files = DownloadData(config, "Kompletter Abzug", ftp, download_cutoff_date, msg, downloader)
+    if not bsz_util.NeedsBothInstances(bsz_util.GetFilenameRegexForSection(config, "Kompletter Abzug")):
         if len(downloaded_files) == 1:
             return downloaded_files
         elif len(downloaded_files) == 0:
@@ -203,37 +232,43 @@ def Main():
     CleanStaleMutexFiles()
 
     ftp = bsz_util.GetFTPConnection()
+    # Lets us list the next remote directory while the files found in the previous ones are still being downloaded:
+    downloader = bsz_util.BackgroundDownloader(bsz_util.GetMaxParallelDownloads(config))
     msg = []
     tempdir = tempfile.TemporaryDirectory()
     bsz_dir = os.getcwd()
     os.chdir(tempdir.name)
     download_cutoff_date = IncrementStringDate(bsz_util.GetCutoffDateForDownloads(config))
-    complete_data_filenames = DownloadCompleteData(config, ftp, download_cutoff_date, msg)
+    complete_data_filenames = DownloadCompleteData(config, ftp, download_cutoff_date, msg, downloader)
     all_downloaded_files = [] if complete_data_filenames == None else complete_data_filenames
     downloaded_at_least_some_new_titles = False
     if complete_data_filenames is not None:
         download_cutoff_date = bsz_util.ExtractDateFromFilename(complete_data_filenames[0])
         downloaded_at_least_some_new_titles = True
-        util.Remove("/usr/local/var/lib/tuelib/local_data.sq3") # Must be the same path as in LocalDataDB.cc
-    all_downloaded_files += DownloadData(config, "Differenzabzug", ftp, download_cutoff_date, msg)
+    all_downloaded_files += DownloadData(config, "Differenzabzug", ftp, download_cutoff_date, msg, downloader)
     if all_downloaded_files:
         downloaded_at_least_some_new_titles = True
-    all_downloaded_files += DownloadData(config, "Loeschlisten", ftp, download_cutoff_date, msg)
+    all_downloaded_files += DownloadData(config, "Loeschlisten", ftp, download_cutoff_date, msg, downloader)
     if config.has_section("Loeschlisten2"):
-        all_downloaded_files += DownloadData(config, "Loeschlisten2", ftp, download_cutoff_date, msg)
+        all_downloaded_files += DownloadData(config, "Loeschlisten2", ftp, download_cutoff_date, msg, downloader)
     if config.has_section("Hinweisabzug"):
-        all_downloaded_files += DownloadData(config, "Hinweisabzug", ftp, "000000", msg)
+        all_downloaded_files += DownloadData(config, "Hinweisabzug", ftp, "000000", msg, downloader)
     if config.has_section("Errors"):
-        all_downloaded_files += DownloadData(config, "Errors", ftp, download_cutoff_date, msg)
+        all_downloaded_files += DownloadData(config, "Errors", ftp, download_cutoff_date, msg, downloader)
     incremental_authority_cutoff_date =  ShiftDateToTenDaysBefore(download_cutoff_date)
     if config.has_section("Normdatendifferenzabzug"):
        if (not CurrentIncrementalAuthorityDumpPresent(config, incremental_authority_cutoff_date)):
-           all_downloaded_files += DownloadData(config, "Normdatendifferenzabzug", ftp, incremental_authority_cutoff_date, msg)
+           all_downloaded_files += DownloadData(config, "Normdatendifferenzabzug", ftp, incremental_authority_cutoff_date, msg, downloader)
        else:
            msg.append("Skipping Download of \"Normdatendifferenzabzug\" since already present\n")
+    downloader.waitForDownloads()
+    msg.append("All queued downloads completed successfully.\n")
+    # N.B. We only get here if the new complete dump has actually arrived, so LocalDataDB can be rebuilt from it.
+    if complete_data_filenames is not None:
+        util.Remove("/usr/local/var/lib/tuelib/local_data.sq3") # Must be the same path as in LocalDataDB.cc
     try:
         for downloaded_file in all_downloaded_files:
-            shutil.copy(downloaded_file, bsz_dir)
+            LinkOrCopyToDirectory(downloaded_file, bsz_dir)
     except Exception as e:
         util.Error("Moving a downloaded file to the BSZ download directory failed! (" + str(e) + ")")
 
@@ -62,15 +62,16 @@ class FTPConnection(AbstractFTP):
             output = open(local_file_path, "wb")
         except Exception as e:
             util.Error("local open of \"" + local_file_path + "\" failed! (" + str(e) + ")")
-        try:
-            def RetrbinaryCallback(chunk):
-                try:
-                    output.write(chunk)
-                except Exception as e:
-                    util.Error("failed to write a data chunk to local file \"" + local_file_path + "\"! (" + str(e) + ")")
-            self._ftp.retrbinary("RETR " + remote_file_name, RetrbinaryCallback)
-        except Exception as e:
-            util.Error("File download failed! (" + str(e) + ")")
+        with output:
+            try:
+                def RetrbinaryCallback(chunk):
+                    try:
+                        output.write(chunk)
+                    except Exception as e:
+                        util.Error("failed to write a data chunk to local file \"" + local_file_path + "\"! (" + str(e) + ")")
+                self._ftp.retrbinary("RETR " + remote_file_name, RetrbinaryCallback)
+            except Exception as e:
+                util.Error("File download failed! (" + str(e) + ")")
 
 
     def uploadFile(self, local_file_path, remote_file_name=None):
@@ -6,6 +6,7 @@
 import datetime
 import os
 import re
+import subprocess
 import sys
 import traceback
 import util
@@ -48,24 +49,39 @@ def Main():
 
     util.default_email_recipient = sys.argv[1]
 
-    most_recent_authority_filename = GetMostRecentBSZFile("^Normdaten-(\d\d\d\d\d\d).mrc$")
+    most_recent_authority_filename = GetMostRecentBSZFile(r"^Normdaten-(\d\d\d\d\d\d).mrc$")
     if most_recent_authority_filename is None:
         util.SendEmailAndExit("Beacon Generator", "Found no matching authority files!", priority=1)
 
-    most_recent_titles_filename = GetMostRecentBSZFile("^GesamtTiteldaten-post-pipeline-(\d\d\d\d\d\d).mrc$")
+    most_recent_titles_filename = GetMostRecentBSZFile(r"^GesamtTiteldaten-post-pipeline-(\d\d\d\d\d\d).mrc$")
     if most_recent_titles_filename is None:
         util.SendEmailAndExit("Beacon Generator", "Found no matching title files!", priority=1)
 
-    # Extract the GND numbers from the 035$a subfield of the MARC authority data for authors:
-    gnd_numbers_path = "/tmp/gnd_numbers"
-    util.ExecOrDie("/usr/local/bin/extract_person_gnd_numbers", [ most_recent_authority_filename ], gnd_numbers_path)
-
-    # Count GND references in the title data:
+    # Extract the GND numbers from the 035$a subfield of the MARC authority data for authors and count the GND
+    # references in the title data.  The GND numbers are streamed through a pipe so that no temporary file has to be
+    # written.  (count_author_gnd_refs loads the entire GND list before it reads the title data, so the two steps only
+    # overlap while that list is being loaded):
     gnd_counts_filename = "/tmp/gnd_counts"
     if len(sys.argv) > 4:
         count_author_gnd_refs_args.append("--control-number-list=" + sys.argv[4])
-    count_author_gnd_refs_args.extend([ gnd_numbers_path, most_recent_titles_filename, gnd_counts_filename ])
-    util.ExecOrDie("/usr/local/bin/count_author_gnd_refs", count_author_gnd_refs_args)
+    count_author_gnd_refs_args.extend([ "/dev/stdin", most_recent_titles_filename, gnd_counts_filename ])
+    extract_person_gnd_numbers = subprocess.Popen([ "/usr/local/bin/extract_person_gnd_numbers",
+                                                    most_recent_authority_filename ], stdout=subprocess.PIPE)
+    try:
+        count_author_gnd_refs = subprocess.Popen([ "/usr/local/bin/count_author_gnd_refs" ] + count_author_gnd_refs_args,
+                                                 stdin=extract_person_gnd_numbers.stdout)
+    except Exception:
+        extract_person_gnd_numbers.kill()
+        raise
+    finally:
+        # Only the two children may hold the pipe, so that the extractor gets SIGPIPE if the counter exits early.
+        extract_person_gnd_numbers.stdout.close()
+    extract_person_gnd_numbers_exit_code = extract_person_gnd_numbers.wait()
+    count_author_gnd_refs_exit_code = count_author_gnd_refs.wait()
+    if extract_person_gnd_numbers_exit_code != 0 or count_author_gnd_refs_exit_code != 0:
+        util.SendEmailAndExit("Beacon Generator", "Failed to extract or count the GND numbers! (exit codes: "
+                              + str(extract_person_gnd_numbers_exit_code) + ", " + str(count_author_gnd_refs_exit_code)
+                              + ")", priority=1)
 
     # Generate a file with a timestamp in the Beacon format:
     timestamp_filename = "/tmp/beacon_timestamp"
@@ -79,11 +95,10 @@ def Main():
     f.close()
 
     # Now generate the final output (bom-utf8 + header + counts):
-    if not util.ConcatenateFiles([file_with_utf8, sys.argv[2], timestamp_filename, gnd_counts_filename], sys.argv[3]):
+    if not util.ConcatenateFilesWithSendfile([file_with_utf8, sys.argv[2], timestamp_filename, gnd_counts_filename], sys.argv[3]):
         util.SendEmailAndExit("Beacon Generator", "An unexpected error occurred: could not write \"" + sys.argv[3] + "\"!", priority=1)
 
     # Cleanup of temp files:
-    os.unlink(gnd_numbers_path)
     os.unlink(timestamp_filename)
     os.unlink(gnd_counts_filename)
     os.unlink(file_with_utf8)
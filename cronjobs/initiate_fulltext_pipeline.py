@@ -31,10 +31,7 @@ def Main():
     conf = util.LoadConfigFile(util.default_config_file_dir + '/' + 'initiate_marc_pipeline.conf')
     link_name = conf.get("Misc", "link_name")
     if bsz_util.FoundNewBSZDataFile(link_name):
-        bsz_data = util.ResolveSymlink(link_name)
-        if not bsz_data.endswith(".tar.gz"):
-            util.Error("BSZ data file must end in .tar.gz!")
-        file_name_list = util.ExtractAndRenameBSZFiles(bsz_data)
+        file_name_list = bsz_util.ExtractBSZDataFromLink(link_name)
         RunPipeline(pipeline_script_name, file_name_list[0], conf)
         util.SendEmail("Fulltext Pipeline", "Pipeline completed successfully.", priority=5)
     else:
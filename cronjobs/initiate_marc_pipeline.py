@@ -1,18 +1,37 @@
 #!/bin/python3
 # -*- coding: utf-8 -*-
+import bsz_util
 import datetime
 import glob
 import itertools
 import json
-import urllib.request, urllib.error, urllib.parse
+import multiprocessing
 import os
+import requests
+import shutil
 import sys
 import subprocess
 import time
 import traceback
+import urllib3
 import util
 from itertools import islice
 
+
+# All requests to Solr go through a session so that consecutive calls reuse a keep-alive connection.
+# Connection failures and gateway errors are retried, as a failure aborts the entire pipeline.  Read timeouts are not
+# retried: Solr may still be working on the request, and e.g. an optimize would otherwise block us for hours.
+# N.B. "allowed_methods" requires urllib3 >= 1.26.
+def CreateSolrSession():
+    retry = urllib3.util.Retry(total=3, read=0, backoff_factor=2, status_forcelist=[ 502, 503, 504 ],
+                               allowed_methods=None)
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(max_retries=retry))
+    return session
+
+
+solr_session = CreateSolrSession()
+
 # Clear the index to do away with old data that might remain otherwise
 # Since no commit is executed here we avoid the empty index problem
 def ClearSolrIndex(index):
@@ -21,8 +40,8 @@ def ClearSolrIndex(index):
         values = "<delete><query>*:*</query></delete>"
         data = values.encode('utf-8')
         headers = {"Content-Type": "application/xml"}
-        request = urllib.request.Request(url, data, headers)
-        urllib.request.urlopen(request, timeout=300)
+        response = solr_session.post(url, data=data, headers=headers, timeout=(5, 300))
+        response.raise_for_status()
     except Exception as e:
         util.SendEmail("MARC-21 Pipeline", "Failed to clear the SOLR index \"" + index + "\" [" + str(e) + "]!", priority=1)
         sys.exit(-1)
@@ -33,11 +52,11 @@ def OptimizeSolrIndex(index):
         # since Solr 7.5, optimization is Solr-internally based on thresholds and therefore no longer forced to be executed on each call.
         # to force optimization every time, it would be necessary to add the maxSegments parameter to force optimization on each call.
         # see also: https://lucidworks.com/post/solr-optimize-merge-expungedeletes-tips/
-        request = urllib.request.Request(
-            "http://localhost:8983/solr/" + index + "/update?optimize=true")
-        urllib.request.urlopen(request, timeout=3600)
-    except:
-        util.SendEmail("MARC-21 Pipeline", "Failed to optimize the SOLR index \"" + index + "\"!", priority=1)
+        response = solr_session.get("http://localhost:8983/solr/" + index + "/update?optimize=true", timeout=(5, 3600))
+        response.raise_for_status()
+    except Exception:
+        util.SendEmail("MARC-21 Pipeline", "Failed to optimize the SOLR index \"" + index + "\"!\n\n" + traceback.format_exc(20),
+                       priority=1)
         sys.exit(-1)
 
 
@@ -46,11 +65,12 @@ def GetPPNsInIndex(index):
       url = "http://localhost:8983/solr/" + index + "/export"
       values = r'q=id:*&sort=id+desc&fl=id'
       data = values.encode('utf-8')
-      request = urllib.request.Request(url, data)
-      with urllib.request.urlopen(request) as response:
-          json_data = json.loads(response.read().decode('utf-8'))
-          ppns = set([ id.get("id") for id in json_data['response']['docs'] ])
-          return ppns
+      headers = {"Content-Type": "application/x-www-form-urlencoded"}
+      response = solr_session.post(url, data=data, headers=headers)
+      response.raise_for_status()
+      json_data = response.json()
+      ppns = set([ id.get("id") for id in json_data['response']['docs'] ])
+      return ppns
    except Exception as e:
         util.SendEmail("MARC-21 Pipeline", "Failed determine all index PPNs from \"" + index + "\" [" + str(e) + "]!", priority=1)
         sys.exit(-1)
@@ -95,13 +115,13 @@ def RemoveExcessRecordsFromIndex(index, marc_file):
             headers = {"Content-Type": "application/json"}
             values = r'{ "delete" : { "query" : "filter(id:(' +  ' '.join(to_delete_batch) + r'))" } }'
             data = values.encode('utf-8')
-            request = urllib.request.Request(url, data, headers)
-            urllib.request.urlopen(request, timeout=300)
+            response = solr_session.post(url, data=data, headers=headers, timeout=(5, 300))
+            response.raise_for_status()
     except Exception as e:
         util.SendEmail("MARC-21 Pipeline", "Failed to remove excess records from \"" + index + "\" [" + str(e) + "]!", priority=1)
         sys.exit(-1)
 
-def ClearIndexAndImportRecords(vufind_dir, script_name, marc_file, log_file_name):
+def ClearIndexAndImportRecords(vufind_dir, script_name, index, marc_file, log_file_name):
     ClearSolrIndex(index)
     util.ExecOrDie(vufind_dir + '/' + script_name, [ marc_file ], log_file_name)
 
@@ -115,38 +135,65 @@ solrmarc_log_summary = "/tmp/solrmarc_log.summary"
 import_log_summary = "/tmp/import_into_vufind_log.summary"
 
 
+# As our file names contain a YYMMDD date, the greatest name is the newest file.
+def GetNewestFileMatchingPattern(pattern):
+    newest_file = max(glob.iglob(pattern), default=None)
+    if newest_file is None:
+        util.Error("\"" + pattern + "\" matched no files!")
+    return newest_file
+
+
+# Runs in a process of its own, cf. ImportIntoVuFind().
+def ImportIntoIndex(vufind_dir, script_name, index, marc_file, log_file_name, clear_solr_index):
+    # Don't share pooled connections with the parent or sibling processes:
+    global solr_session
+    solr_session = CreateSolrSession()
+
+    if not clear_solr_index:
+        ImportRecordsAndRemoveExcessRecords(vufind_dir, script_name, index, marc_file, log_file_name)
+    else:
+        ClearIndexAndImportRecords(vufind_dir, script_name, index, marc_file, log_file_name)
+
+    OptimizeSolrIndex(index)
+
+
+# Appends the contents of "log_file_names" to "target_log_file_name" and removes them.
+def MergeLogFiles(log_file_names, target_log_file_name):
+    with open(target_log_file_name, "ab") as target_log_file:
+        for log_file_name in log_file_names:
+            if os.path.exists(log_file_name):
+                with open(log_file_name, "rb") as log_file:
+                    shutil.copyfileobj(log_file, target_log_file)
+                util.Remove(log_file_name)
+
+
 def ImportIntoVuFind(title_pattern, authority_pattern, log_file_name, clear_solr_index):
     vufind_dir = os.getenv("VUFIND_HOME");
     if vufind_dir == None:
         util.Error("VUFIND_HOME not set, cannot start solr import!")
 
-    # import title data
+    # The title and authority data go into different indices, so we import them in parallel, each with a log of its own:
     title_index = 'biblio'
-    title_args = [ sorted(glob.glob(title_pattern), reverse=True)[0] ]
-    if len(title_args) != 1:
-        util.Error("\"" + title_pattern + "\" matched " + str(len(title_args))
-                   + " files! (Should have matched exactly 1 file!)")
-
-    if not clear_solr_index:
-        ImportRecordsAndRemoveExcessRecords(vufind_dir, 'import-marc.sh', title_index, title_args[0], log_file_name)
-    else:
-        ClearIndexAndImportRecords(vufind_dir, 'import-marc.sh', title_args[0], log_file_name)
-
-    OptimizeSolrIndex(title_index)
+    title_file = GetNewestFileMatchingPattern(title_pattern)
+    title_log_file_name = os.path.splitext(log_file_name)[0] + "." + title_index + ".log"
+    import_title_data_process = multiprocessing.Process(target=ImportIntoIndex, name="Import title data",
+                                    args=[ vufind_dir, 'import-marc.sh', title_index, title_file, title_log_file_name,
+                                           clear_solr_index ])
 
-    # import authority data
     authority_index = 'authority'
-    authority_args = [ sorted(glob.glob(authority_pattern), reverse=True)[0] ]
-    if len(authority_args) != 1:
-        util.Error("\"" + authority_pattern + "\" matched " + str(len(authority_args))
-                   + " files! (Should have matched exactly 1 file!)")
+    authority_file = GetNewestFileMatchingPattern(authority_pattern)
+    authority_log_file_name = os.path.splitext(log_file_name)[0] + "." + authority_index + ".log"
+    import_authority_data_process = multiprocessing.Process(target=ImportIntoIndex, name="Import authority data",
+                                        args=[ vufind_dir, 'import-marc-auth.sh', authority_index, authority_file,
+                                               authority_log_file_name, clear_solr_index ])
+
+    # N.B. Both import scripts still log to the shared $VUFIND_HOME/import/solrmarc.log (configured via VuFind's
+    # log4j.properties), so the entries of the two imports are interleaved in it and in the emailed summary of it.
+    # Also, two SolrMarc JVMs run at the same time, so the host needs room for twice the heap given in INDEX_OPTIONS.
+    util.ExecuteInParallel(import_title_data_process, import_authority_data_process)
+    # N.B. Upon failure, we never get here and the per-index logs remain where the error emails point to.
+    MergeLogFiles([ title_log_file_name, authority_log_file_name ], log_file_name)
 
-    if not clear_solr_index:
-        ImportRecordsAndRemoveExcessRecords(vufind_dir, 'import-marc-auth.sh', authority_index, authority_args[0], log_file_name)
-    else:
-        ClearIndexAndImportRecords(vufind_dir, 'import-marc-auth.sh', authority_args[0], log_file_name)
-
-    OptimizeSolrIndex(authority_index)
     util.ExecOrDie(util.Which("sudo"), ["-u", "solr", "-E", vufind_dir + "/index-alphabetic-browse.sh"], log_file_name)
 
     # cleanup logs
@@ -167,18 +214,6 @@ def RunPipelineAndImportIntoSolr(pipeline_script_name, marc_title, conf, clear_s
         output.write(str(datetime.datetime.now()))
 
 
-# Returns True if we have no timestamp file or if link_filename's creation time is more recent than
-# the time found in the timestamp file.
-def FoundNewBSZDataFile(link_filename):
-    try:
-        statinfo = os.stat(link_filename)
-        file_creation_time = statinfo.st_ctime
-    except OSError:
-        util.Error("in FoundNewBSZDataFile: Symlink \"" + link_filename + "\" is missing or dangling!")
-    old_timestamp = util.ReadTimestamp()
-    return old_timestamp < file_creation_time
-
-
 REFTERM_MUTEX_FILE = "/usr/local/var/tmp/create_refterm_successful" # Must match mutex file name in create_refterm_file.py
 
 
@@ -229,13 +264,10 @@ def Main():
          sys.exit(-1)
     conf = util.LoadConfigFile()
     link_name = conf.get("Misc", "link_name")
-    if FoundNewBSZDataFile(link_name):
+    if bsz_util.FoundNewBSZDataFile(link_name):
         if not FoundReftermMutex():
              util.Error("No Refterm Mutex found")
-        bsz_data = util.ResolveSymlink(link_name)
-        if not bsz_data.endswith(".tar.gz"):
-            util.Error("BSZ data file must end in .tar.gz!")
-        file_name_list = util.ExtractAndRenameBSZFiles(bsz_data)
+        file_name_list = bsz_util.ExtractBSZDataFromLink(link_name)
 
         RunPipelineAndImportIntoSolr(pipeline_script_name, file_name_list[0], conf, clear_solr_index)
         util.WriteTimestamp()
@@ -14,6 +14,12 @@ from os import (path)
 from abstract_ftp import AbstractFTP
 import util
 
+
+# Buffer local writes in 1 MiB blocks instead of the 8 KiB default, as paramiko hands us the (prefetched) data
+# of our multi-megabyte tarballs in small chunks.
+DOWNLOAD_BUFFER_SIZE = 1 << 20
+
+
 class SFTPConnection(AbstractFTP):  
   _host = ""
   _username = ""
@@ -74,10 +80,16 @@ class SFTPConnection(AbstractFTP):
     util.Info(f"downloading file from {self._host}:{remote_file_path} to {local_file_path}")
     
     try:
-      self._sftp.get(remote_file_path, local_file_path)
+      with open(local_file_path, "wb", buffering=DOWNLOAD_BUFFER_SIZE) as local_file:
+        transferred_size = self._sftp.getfo(remote_file_path, local_file)
+      local_size = path.getsize(local_file_path)
     except Exception as excp:
       util.Error(f"File download failed! ({excp})")
 
+    # Same check as paramiko's get(), which we cannot use as it offers no control over the local file's buffering.
+    if local_size != transferred_size:
+      util.Error(f"File download failed! (size mismatch: {local_size} != {transferred_size})")
+
 
   def uploadFile(self, local_file_path, remote_file_path=None):
     if remote_file_path is None:
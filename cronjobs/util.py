@@ -10,8 +10,10 @@ import datetime
 import email
 import enum
 import errno
+import fcntl
 import glob
 import inspect
+import json
 import mmap
 import os
 import process_util
@@ -203,6 +205,31 @@ def ConcatenateFiles(files, target):
     return process_util.Exec("/bin/cat", files, new_stdout=target) == 0
 
 
+# @brief Like ConcatenateFiles() but copies the data within the kernel using sendfile(2) instead of spawning cat.
+# @return True if we succeeded, else False.
+def ConcatenateFilesWithSendfile(files, target):
+    if files is None or len(files) == 0:
+        Error("\"files\" argument to util.ConcatenateFilesWithSendfile() is empty or None!")
+    if target is None or len(target) == 0:
+        Error("\"target\" argument to util.ConcatenateFilesWithSendfile() is empty or None!")
+    try:
+        target_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            for file in files:
+                source_fd = os.open(file, os.O_RDONLY)
+                try:
+                    while os.sendfile(target_fd, source_fd, None, 1 << 30) > 0:
+                        pass
+                finally:
+                    os.close(source_fd)
+        finally:
+            os.close(target_fd)
+    except OSError as e:
+        Warning("in util.ConcatenateFilesWithSendfile: " + str(e))
+        return False
+    return True
+
+
 # Fails if "source" does not exist or if "link_name" exists and is not a symlink.
 # Calls Error() upon failure and aborts the program.
 def SafeSymlink(source, link_name):
@@ -302,23 +329,8 @@ def LoadConfigFile(path=None, no_error=False):
 # @param name_prefix  If not None, this will be prepended to the names of the extracted files
 # @return The list of names of the extracted files in the order: title data, superior data, norm data
 def ExtractAndRenameBSZFiles(gzipped_tar_archive, name_prefix = None):
-    # Ensures that all members of "gzipped_tar_archive" match our expectation as to what the BSZ should deliver.
-    def TarFileMemberNamesAreOkOrDie(tar_file, archive_name):
-        compiled_pattern = re.compile("(aut|tit).mrc$")
-        for member in tar_file.getnames():
-            if not compiled_pattern.search(member):
-                Error("unknown tar file member \"" + member + "\" in \"" + archive_name + "\"!")
-
-
-    # Extracts all tar file members matching "member_pattern" from "tar_file" and concatenates them as "new_name".
-    def ExtractAndRenameMembers(tar_file, member_pattern, new_name):
-        extracted_files = []
-        compiled_pattern = re.compile(member_pattern)
-        for member in tar_file.getnames():
-            if compiled_pattern.match(member):
-                tar_file.extract(member)
-                extracted_files.append(member)
-
+    # Concatenates "extracted_files" as "new_name".
+    def RenameMembers(extracted_files, new_name):
         Remove(new_name)
         ConcatenateFiles(extracted_files, new_name)
 
@@ -329,17 +341,71 @@ def ExtractAndRenameBSZFiles(gzipped_tar_archive, name_prefix = None):
 
     if name_prefix is None:
         name_prefix = ""
-    tar_file = tarfile.open(gzipped_tar_archive, "r:gz")
-    TarFileMemberNamesAreOkOrDie(tar_file, gzipped_tar_archive)
+
+    # We stream through the archive ("r|gz") in a single in-order pass, since random access to a gzipped tar archive
+    # means decompressing it again from the start for each backward seek.  All members must match our expectation as
+    # to what the BSZ should deliver.
+    allowed_member_pattern = re.compile("(aut|tit).mrc$")
+    title_member_pattern = re.compile("^tit.mrc$")
+    norm_member_pattern = re.compile("^aut.mrc$")
+    extracted_title_files = []
+    extracted_norm_files = []
+    with tarfile.open(gzipped_tar_archive, "r|gz") as tar_file:
+        for member in tar_file:
+            if not allowed_member_pattern.search(member.name):
+                for extracted_file in extracted_title_files + extracted_norm_files:
+                    Remove(extracted_file)
+                Error("unknown tar file member \"" + member.name + "\" in \"" + gzipped_tar_archive + "\"!")
+            if title_member_pattern.match(member.name):
+                tar_file.extract(member)
+                extracted_title_files.append(member.name)
+            elif norm_member_pattern.match(member.name):
+                tar_file.extract(member)
+                extracted_norm_files.append(member.name)
+
     current_date_str = datetime.datetime.now().strftime("%y%m%d")
-    ExtractAndRenameMembers(tar_file, "^tit.mrc$",
-                            name_prefix + "GesamtTiteldaten-" + current_date_str + ".mrc")
-    ExtractAndRenameMembers(tar_file, "^aut.mrc$", name_prefix + "Normdaten-" + current_date_str + ".mrc")
+    RenameMembers(extracted_title_files, name_prefix + "GesamtTiteldaten-" + current_date_str + ".mrc")
+    RenameMembers(extracted_norm_files, name_prefix + "Normdaten-" + current_date_str + ".mrc")
 
     return [name_prefix + "GesamtTiteldaten-" + current_date_str + ".mrc",
             name_prefix + "Normdaten-" + current_date_str + ".mrc"]
 
 
+# Like ExtractAndRenameBSZFiles() but reuses the files extracted by an earlier call for the same archive, e.g. by
+# another cronjob processing the same BSZ dump.  The names of the extracted files are recorded in a manifest next to
+# the archive which is only trusted if the archive has not been modified since and all the files still exist.
+# Concurrent callers are serialised via a lock file next to the archive, so whoever comes first extracts and the
+# others wait for and then use its manifest.
+# N.B. Extraction itself must remain a single in-order pass over the archive, as every backward seek in a gzipped
+#      tar archive restarts decompression from the very beginning.
+# @return The list of names of the extracted files in the order: title data, norm data
+def ExtractAndRenameBSZFilesOnce(gzipped_tar_archive, name_prefix = None):
+    with open(gzipped_tar_archive + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX) # Released when "lock_file" gets closed.
+
+        manifest_filename = gzipped_tar_archive + ".extracted.json"
+        archive_mtime = os.stat(gzipped_tar_archive).st_mtime
+        try:
+            with open(manifest_filename, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest["archive_mtime"] == archive_mtime and manifest["directory"] == os.getcwd() \
+               and manifest["name_prefix"] == name_prefix \
+               and all(os.path.exists(extracted_file) for extracted_file in manifest["extracted_files"]):
+                return manifest["extracted_files"]
+        except (OSError, ValueError, KeyError):
+            pass # No usable manifest => extract.
+
+        extracted_files = ExtractAndRenameBSZFiles(gzipped_tar_archive, name_prefix)
+
+        # Write the manifest atomically so that a reader never sees a partial one:
+        temp_manifest_filename = manifest_filename + ".tmp"
+        with open(temp_manifest_filename, "w") as temp_manifest_file:
+            json.dump({ "archive_mtime": archive_mtime, "directory": os.getcwd(), "name_prefix": name_prefix,
+                        "extracted_files": extracted_files }, temp_manifest_file)
+        os.replace(temp_manifest_filename, manifest_filename)
+        return extracted_files
+
+
 def IsExecutableFile(executable_candidate):
     return os.path.isfile(executable_candidate) and os.access(executable_candidate, os.X_OK)
 
@@ -452,6 +518,18 @@ def ExecOrDie(cmd_name, args, log_file_name=None, setsid=True):
         sys.exit(-1)
 
 
+# Starts all of "processes", e.g. multiprocessing.Process instances, and waits for them to finish.
+# Calls Error() if any of them fails.
+def ExecuteInParallel(*processes):
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            Error(process.name + " failed")
+
+
 # @brief Looks for "executable_name" in $PATH unless it contains a slash.
 # @return Either the path to an executable program or the empty string.
 def Which(executable_name):